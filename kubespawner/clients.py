@@ -1,6 +1,6 @@
 """Configures and instantiates REST API clients of various kinds to
 communicate with a Kubernetes api-server, but only one instance per kind is
-instantiated.
+instantiated, and all of them share a single underlying ApiClient.
 
 The instances of these REST API clients are also patched to avoid the creation
 of unused threads.
@@ -29,46 +29,96 @@ api_client.ThreadPool = lambda *args, **kwargs: _dummy_pool
 _client_cache = {}
 
 
-def shared_client(ClientType, *args, **kwargs):
-    """Return a shared kubernetes client instance
-    based on the provided arguments.
+def shared_api_client():
+    """Return the kubernetes ApiClient shared by all shared_client instances.
 
-    Cache is one client per running loop per combination of input args.
+    All API groups share one ApiClient, and therefore one aiohttp connection
+    pool, so connections to the api-server are reused across them.
 
-    Client will be closed when the loop closes.
+    Cache is one ApiClient per running loop.
+
+    The ApiClient will be closed when the loop closes, and the shared_client
+    instances using it are dropped from the cache at that point.
     """
-    kwarg_key = tuple((key, kwargs[key]) for key in sorted(kwargs))
-    cache_key = (asyncio.get_running_loop(), ClientType, args, kwarg_key)
-    client = _client_cache.get(cache_key, None)
+    loop = asyncio.get_running_loop()
+    cache_key = (loop, api_client.ApiClient)
+    shared = _client_cache.get(cache_key, None)
 
-    if client is None:
+    if shared is None:
         # Kubernetes client configuration is handled globally and should already
         # be configured from spawner.py or proxy.py via the load_config function
-        # prior to a shared_client being instantiated.
-        Client = getattr(kubernetes_asyncio.client, ClientType)
-        client = Client(*args, **kwargs)
+        # prior to a shared_api_client being instantiated.
+        shared = api_client.ApiClient()
 
-        _client_cache[cache_key] = client
+        _client_cache[cache_key] = shared
 
         # create a task that will close the client when it is cancelled
         # relies on JupyterHub's task cleanup at shutdown
         async def close_client_task():
             try:
-                async with client.api_client:
+                async with shared:
                     while True:
                         await asyncio.sleep(300)
             except asyncio.CancelledError:
                 pass
             finally:
                 _client_cache.pop(cache_key, None)
+                for key, client in list(_client_cache.items()):
+                    if key[0] is loop and client.api_client is shared:
+                        _client_cache.pop(key, None)
 
         asyncio.create_task(close_client_task())
 
+    return shared
+
+
+def shared_client(ClientType, *args, **kwargs):
+    """Return a shared kubernetes client instance
+    based on the provided arguments.
+
+    Cache is one client per running loop per combination of input args.
+
+    Unless an ApiClient is passed explicitly, the client uses the ApiClient
+    returned by shared_api_client.
+
+    Client will be closed when the loop closes.
+    """
+    kwarg_key = tuple((key, kwargs[key]) for key in sorted(kwargs))
+    cache_key = (asyncio.get_running_loop(), ClientType, args, kwarg_key)
+    client = _client_cache.get(cache_key, None)
+
+    if client is None:
+        shared = shared_api_client()
+        if not args:
+            kwargs.setdefault("api_client", shared)
+        Client = getattr(kubernetes_asyncio.client, ClientType)
+        client = Client(*args, **kwargs)
+
+        _client_cache[cache_key] = client
+
+        # the shared ApiClient is closed by shared_api_client's task, any
+        # other ApiClient gets a task of its own that closes it when cancelled
+        if client.api_client is not shared:
+
+            async def close_client_task():
+                try:
+                    async with client.api_client:
+                        while True:
+                            await asyncio.sleep(300)
+                except asyncio.CancelledError:
+                    pass
+                finally:
+                    _client_cache.pop(cache_key, None)
+
+            asyncio.create_task(close_client_task())
+
     return client
 
 
 @lru_cache()
-def load_config(host=None, ssl_ca_cert=None, verify_ssl=None):
+def load_config(
+    host=None, ssl_ca_cert=None, verify_ssl=None, connection_pool_maxsize=None
+):
     """
     Loads global configuration for the Python client we use to communicate with
     a Kubernetes API server, and optionally tweaks that configuration based on
@@ -103,3 +153,7 @@ def load_config(host=None, ssl_ca_cert=None, verify_ssl=None):
         global_conf = Configuration.get_default_copy()
         global_conf.verify_ssl = verify_ssl
         Configuration.set_default(global_conf)
+    if connection_pool_maxsize is not None:
+        global_conf = Configuration.get_default_copy()
+        global_conf.connection_pool_maxsize = connection_pool_maxsize
+        Configuration.set_default(global_conf)
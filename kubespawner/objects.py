@@ -808,6 +808,7 @@ def make_ingress(
         # ingress -> service -> endpoint -> pod
         # endpoint is used just to allow access from ingress to Pod IP (if PodNetworkPolicy is used)
         endpoint = V1Endpoints(
+            api_version='v1',
             kind='Endpoints',
             metadata=meta,
             subsets=[
@@ -819,6 +820,7 @@ def make_ingress(
         )
 
         service = V1Service(
+            api_version='v1',
             kind='Service',
             metadata=meta,
             spec=V1ServiceSpec(
@@ -861,6 +863,7 @@ def make_ingress(
 
             # Ingress -> ExternalName -> Service (different namespace or some external domain)
             service = V1Service(
+                api_version='v1',
                 kind='Service',
                 metadata=meta,
                 spec=V1ServiceSpec(
@@ -940,6 +943,7 @@ def make_ingress(
     ]
 
     ingress = V1Ingress(
+        api_version='networking.k8s.io/v1',
         kind='Ingress',
         metadata=ingress_meta,
         spec=V1IngressSpec(
@@ -1,13 +1,14 @@
 import asyncio
-import json
 import os
 import string
+from functools import partial
+from types import MappingProxyType
 
 import escapism
 from jupyterhub.proxy import Proxy
 from jupyterhub.utils import exponential_backoff
 from kubernetes_asyncio import client
-from traitlets import Bool, Dict, List, Unicode
+from traitlets import Bool, Dict, Integer, List, Unicode
 
 from .clients import load_config, shared_client
 from .objects import make_ingress
@@ -15,15 +16,149 @@ from .reflector import ResourceReflector
 from .slugs import escape_slug
 from .utils import generate_hashed_slug
 
+# Use orjson if it is installed, it decodes the data annotation of routes
+# considerably faster than the standard library's json module.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Characters left unescaped by escapism when deriving k8s object names from
+# routespecs, everything else is escaped as -XX with uppercase hex.
+_SAFE_CHARS = frozenset(string.ascii_lowercase + string.digits)
+
+# Annotations on the Ingress resources describing the route they were created
+# for, see make_ingress.
+_ROUTESPEC_ANNOTATION = 'hub.jupyter.org/proxy-routespec'
+_TARGET_ANNOTATION = 'hub.jupyter.org/proxy-target'
+_DATA_ANNOTATION = 'hub.jupyter.org/proxy-data'
+
+# Statuses of k8s api-server responses that indicate a transient problem, for
+# which idempotent requests are retried.
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
 
 class IngressReflector(ResourceReflector):
     kind = 'ingresses'
     api_group_name = 'NetworkingV1Api'
 
+    routes = Dict(
+        {},
+        help="""
+        Dictionary of resource names to the routes described by the
+        annotations of the ingress resources.
+
+        Kept up-to-date alongside `resources`, so that routes don't have to be
+        parsed again every time they are requested.
+        """,
+    )
+
+    routes_by_routespec = Dict(
+        {},
+        help="""
+        Dictionary of routespecs to the routes in `routes`.
+
+        This is the form JupyterHub requests routes in, it is kept up-to-date
+        alongside `routes` so it doesn't have to be rebuilt on every request.
+        """,
+    )
+
+    # routespecs to the names of all the ingresses describing them, so another
+    # ingress can take over a routespec without searching all `routes`
+    _ref_keys_by_routespec = Dict({})
+
     @property
     def ingresses(self):
         return self.resources
 
+    @staticmethod
+    def _route_for_ingress(ingress):
+        annotations = ingress["metadata"].get("annotations") or {}
+        return {
+            'routespec': annotations[_ROUTESPEC_ANNOTATION],
+            'target': annotations[_TARGET_ANNOTATION],
+            'data': json_loads(annotations[_DATA_ANNOTATION]),
+        }
+
+    def _parse_route(self, ref_key, ingress):
+        """
+        Return the route described by an ingress, or None if it doesn't
+        describe a valid route.
+
+        An ingress with missing or undecodable annotations is skipped with a
+        warning, as it must not stop us from keeping track of the others.
+        """
+        try:
+            return self._route_for_ingress(ingress)
+        except (KeyError, ValueError) as e:
+            self.log.warning(
+                "Ignoring ingress %s, it doesn't describe a valid route: %r",
+                ref_key,
+                e,
+            )
+            return None
+
+    async def _list_and_update(self, resource_version=None):
+        previous_resources = self.resources
+        previous_routes = self.routes
+        resource_version = await super()._list_and_update(resource_version)
+
+        # A full fetch is done every time the watch is restarted, which is at
+        # least every restart_seconds. Most ingresses won't have changed since
+        # the previous fetch, so we reuse their already parsed routes.
+        routes = {}
+        for ref_key, ingress in self.resources.items():
+            previous_ingress = previous_resources.get(ref_key)
+            if (
+                ref_key in previous_routes
+                and previous_ingress is not None
+                and previous_ingress["metadata"]["resourceVersion"]
+                == ingress["metadata"]["resourceVersion"]
+            ):
+                routes[ref_key] = previous_routes[ref_key]
+            else:
+                route = self._parse_route(ref_key, ingress)
+                if route is not None:
+                    routes[ref_key] = route
+
+        ref_keys_by_routespec = {}
+        for ref_key, route in routes.items():
+            ref_keys_by_routespec.setdefault(route['routespec'], set()).add(ref_key)
+
+        # These are atomic operations on the dictionaries!
+        self._ref_keys_by_routespec = ref_keys_by_routespec
+        self.routes = routes
+        self.routes_by_routespec = {
+            route['routespec']: route for route in routes.values()
+        }
+        return resource_version
+
+    def on_event(self, event_type, ref_key, resource):
+        previous_route = self.routes.pop(ref_key, None)
+        route = None
+        if event_type != 'DELETED':
+            route = self._parse_route(ref_key, resource)
+            if route is not None:
+                self.routes[ref_key] = route
+
+        if previous_route is not None and (
+            route is None or route['routespec'] != previous_route['routespec']
+        ):
+            routespec = previous_route['routespec']
+            ref_keys = self._ref_keys_by_routespec[routespec]
+            ref_keys.discard(ref_key)
+            if not ref_keys:
+                del self._ref_keys_by_routespec[routespec]
+                del self.routes_by_routespec[routespec]
+            elif self.routes_by_routespec[routespec] is previous_route:
+                # another ingress still describes the same route
+                self.routes_by_routespec[routespec] = self.routes[next(iter(ref_keys))]
+
+        if route is not None:
+            routespec = route['routespec']
+            self._ref_keys_by_routespec.setdefault(routespec, set()).add(ref_key)
+            self.routes_by_routespec[routespec] = route
+
 
 class ServiceReflector(ResourceReflector):
     kind = 'services'
@@ -317,16 +452,63 @@ class KubeIngressProxy(Proxy):
         """,
     )
 
+    k8s_api_connection_pool_maxsize = Integer(
+        None,
+        allow_none=True,
+        config=True,
+        help="""
+        Maximum number of simultaneous connections to the k8s API server.
+
+        Requests beyond this limit wait for a connection to become available,
+        which can add latency to `add_route` and `delete_route` when many
+        routes are changed at once, for example when many users start their
+        servers at the same time.
+
+        The connection pool is shared with KubeSpawner and the reflectors.
+        Defaults to the default of the kubernetes_asyncio client.
+        """,
+    )
+
+    k8s_api_request_retry_timeout = Integer(
+        30,
+        config=True,
+        help="""
+        Total timeout, including retry timeout, for kubernetes API calls
+
+        When an idempotent k8s API request fails with a status indicating a
+        transient problem with the k8s api-server, such as 429, 500, 502, 503,
+        or 504, we retry it while backing off exponentially. This lets you
+        configure the total amount of time we will spend trying an API request
+        - including retries - before giving up.
+        """,
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         load_config(
             host=self.k8s_api_host,
             ssl_ca_cert=self.k8s_api_ssl_ca_cert,
             verify_ssl=self.k8s_api_verify_ssl,
+            connection_pool_maxsize=self.k8s_api_connection_pool_maxsize,
         )
         self.core_api = shared_client('CoreV1Api')
         self.networking_api = shared_client('NetworkingV1Api')
 
+        # the hub namespace expanded in templates is read from the service
+        # account's files, which don't change while we are running
+        self._hub_namespace = self._namespace_default()
+        if self._hub_namespace == "default":
+            self._hub_namespace = "user"
+
+        # labels set on all resources created by add_route, read-only as the
+        # same mapping is reused by every add_route call
+        self._component_labels = MappingProxyType(
+            {
+                'app.kubernetes.io/component': self.component_label,
+                'component': self.component_label,
+            }
+        )
+
         labels = {
             # NOTE: We monitor resources with the old component label instead of
             #       the modern app.kubernetes.io/component label. A change here
@@ -351,106 +533,180 @@ class KubeIngressProxy(Proxy):
             parent=self, namespace=self.namespace, labels=labels
         )
 
-        # schedule our reflectors to start in the event loop,
-        # reflectors first load can be awaited with:
+        # schedule our reflectors to start concurrently in the event loop, all
+        # of them list and watch via the same shared ApiClient. We keep a
+        # reference to the scheduled future, as the event loop only keeps weak
+        # references to tasks. Reflectors first load can be awaited with:
         #
-        #   await some_reflector._first_load_future
+        #   await some_reflector.first_load_future
         #
-        asyncio.ensure_future(self.ingress_reflector.start())
-        asyncio.ensure_future(self.service_reflector.start())
-        asyncio.ensure_future(self.endpoint_reflector.start())
+        self._start_reflectors_future = asyncio.gather(
+            self.ingress_reflector.start(),
+            self.service_reflector.start(),
+            self.endpoint_reflector.start(),
+        )
 
     def _safe_name_for_routespec(self, routespec):
         # FIXME: escape_slug isn't exactly as whats done here, because we aren't
         #        calling .lower(), it may have been fine to just transition to
         #        escape_slug though, but its wasn't obvious a safe change so it
         #        wasn't done.
-        safe_chars = set(string.ascii_lowercase + string.digits)
         safe_name = generate_hashed_slug(
             'jupyter-'
-            + escapism.escape(routespec, safe=safe_chars, escape_char='-')
+            + escapism.escape(routespec, safe=_SAFE_CHARS, escape_char='-')
             + '-route'
         )
         return safe_name
 
-    def _expand_user_properties(self, template, routespec, data):
-        raw_servername = data.get('server_name') or ''
-        safe_servername = escape_slug(raw_servername)
+    def _object_name_for_routespec(self, routespec):
+        # k8s object names must be lowercase, but escapism escapes with
+        # uppercase hex, so unlike the hashed names generated for long
+        # routespecs, the names for short routespecs must be lowercased here
+        return self._safe_name_for_routespec(routespec).lower()
 
-        hub_namespace = self._namespace_default()
-        if hub_namespace == "default":
-            hub_namespace = "user"
+    def _template_values(self, routespec, data):
+        """
+        Return the values templates are expanded with for a route.
 
+        These are computed once per route, and then reused for all the
+        templates expanded with _expand_all.
+        """
+        raw_servername = data.get('server_name') or ''
         raw_username = data.get('user') or ''
-        safe_username = escape_slug(raw_username)
-
         raw_servicename = data.get('services') or ''
-        safe_servicename = escape_slug(raw_servicename)
-
-        raw_routespec = routespec
-        safe_routespec = self._safe_name_for_routespec(routespec)
-
-        rendered = template.format(
-            username=safe_username,
-            unescaped_username=raw_username,
-            servername=safe_servername,
-            unescaped_servername=raw_servername,
-            servicename=safe_servicename,
-            unescaped_servicename=raw_servicename,
-            routespec=safe_routespec,
-            unescaped_routespec=raw_routespec,
-            hubnamespace=hub_namespace,
-        )
+        return {
+            'username': escape_slug(raw_username),
+            'unescaped_username': raw_username,
+            'servername': escape_slug(raw_servername),
+            'unescaped_servername': raw_servername,
+            'servicename': escape_slug(raw_servicename),
+            'unescaped_servicename': raw_servicename,
+            'routespec': self._safe_name_for_routespec(routespec),
+            'unescaped_routespec': routespec,
+            'hubnamespace': self._hub_namespace,
+        }
+
+    def _expand_user_properties(self, template, values):
+        rendered = template.format(**values)
         # strip trailing - delimiter in case of empty servername.
         # k8s object names cannot have trailing -
         return rendered.rstrip("-")
 
-    def _expand_all(self, src, routespec, data):
+    def _expand_all(self, src, values):
         if isinstance(src, list):
-            return [self._expand_all(i, routespec, data) for i in src]
+            return [self._expand_all(i, values) for i in src]
         elif isinstance(src, dict):
-            return {k: self._expand_all(v, routespec, data) for k, v in src.items()}
+            return {k: self._expand_all(v, values) for k, v in src.items()}
         elif isinstance(src, str):
-            return self._expand_user_properties(src, routespec, data)
+            return self._expand_user_properties(src, values)
         else:
             return src
 
-    async def _delete_if_exists(self, kind, safe_name, future):
+    async def _retry_transient_errors(self, request_func, fail_message):
+        """
+        Make an API request by calling request_func, and retry it with
+        exponential backoff if it fails because of a transient error.
+
+        request_func is called again for every attempt, so it must make an
+        idempotent request. Returns the response to the successful attempt.
+        """
+        response = None
+
+        async def attempt():
+            nonlocal response
+            try:
+                response = await request_func()
+            except client.rest.ApiException as e:
+                if e.status not in _RETRY_STATUSES:
+                    raise
+                self.log.warning(
+                    "%s: %s %s, retrying", fail_message, e.status, e.reason
+                )
+                return False
+            return True
+
+        await exponential_backoff(
+            attempt,
+            fail_message,
+            timeout=self.k8s_api_request_retry_timeout,
+        )
+        return response
+
+    async def _delete_if_exists(self, kind, safe_name, delete_func):
         try:
-            await future
+            await self._retry_transient_errors(
+                delete_func, f'Could not delete {kind}/{safe_name}'
+            )
             self.log.info('Deleted %s/%s', kind, safe_name)
         except client.rest.ApiException as e:
             if e.status != 404:
                 raise
             self.log.warn("Could not delete %s/%s: does not exist", kind, safe_name)
 
+    async def _delete_leftover(self, reflector, kind, delete_func, safe_name):
+        """
+        Delete an object left over from a previous version of a route.
+
+        Only an object our reflector knows about is deleted, as the request
+        would otherwise just fail with a 404.
+        """
+        if not reflector.first_load_future.done():
+            await reflector.first_load_future
+        if f'{self.namespace}/{safe_name}' in reflector.resources:
+            await self._delete_if_exists(
+                kind,
+                safe_name,
+                partial(
+                    delete_func,
+                    name=safe_name,
+                    namespace=self.namespace,
+                    body=client.V1DeleteOptions(grace_period_seconds=0),
+                ),
+            )
+
+    async def _ensure_object(self, patch_func, body, kind, safe_name):
+        """
+        Ensure a k8s object exists as described by body, by calling patch_func.
+
+        Server-side apply creates the object, or updates it to be what we want
+        if it already exists, in a single idempotent request.
+        """
+        await self._retry_transient_errors(
+            partial(
+                patch_func,
+                namespace=self.namespace,
+                name=body.metadata.name,
+                body=body,
+                field_manager='kubespawner',
+                force=True,
+                _content_type='application/apply-patch+yaml',
+            ),
+            f'Could not apply {kind}/{safe_name}',
+        )
+        self.log.info('Applied %s/%s', kind, safe_name)
+
     async def add_route(self, routespec, target, data):
         # Create a route with the name being escaped routespec
         # Use full routespec in label
         # 'data' is JSON encoded and put in an annotation - we don't need to query for it
 
-        safe_name = self._safe_name_for_routespec(routespec).lower()
+        safe_name = self._object_name_for_routespec(routespec)
         full_name = f'{self.namespace}/{safe_name}'
 
-        common_labels = self._expand_all(self.common_labels, routespec, data)
-        common_labels.update(
-            {
-                'app.kubernetes.io/component': self.component_label,
-                'component': self.component_label,
-            }
-        )
+        template_values = self._template_values(routespec, data)
+
+        common_labels = self._expand_all(self.common_labels, template_values)
+        common_labels.update(self._component_labels)
 
         ingress_extra_labels = self._expand_all(
-            self.ingress_extra_labels, routespec, data
+            self.ingress_extra_labels, template_values
         )
         ingress_extra_annotations = self._expand_all(
-            self.ingress_extra_annotations, routespec, data
+            self.ingress_extra_annotations, template_values
         )
 
         ingress_specifications = self._expand_all(
-            self.ingress_specifications,
-            routespec,
-            data,
+            self.ingress_specifications, template_values
         )
 
         endpoint, service, ingress = make_ingress(
@@ -467,97 +723,104 @@ class KubeIngressProxy(Proxy):
             reuse_existing_services=self.reuse_existing_services,
         )
 
-        async def ensure_object(create_func, patch_func, body, kind):
-            try:
-                await create_func(namespace=self.namespace, body=body)
-                self.log.info('Created %s/%s', kind, safe_name)
-            except client.rest.ApiException as e:
-                if e.status == 409:
-                    # This object already exists, we should patch it to make it be what we want
-                    self.log.warn(
-                        "Trying to patch %s/%s, it already exists", kind, safe_name
-                    )
-                    await patch_func(
-                        namespace=self.namespace,
-                        body=body,
-                        name=body.metadata.name,
-                    )
-                else:
-                    raise
-
-        if endpoint is not None:
-            await ensure_object(
-                self.core_api.create_namespaced_endpoints,
-                self.core_api.patch_namespaced_endpoints,
-                body=endpoint,
-                kind='endpoints',
-            )
-
-            await exponential_backoff(
-                lambda: full_name in self.endpoint_reflector.endpoints,
-                'Could not find endpoints/%s after creating it' % safe_name,
-            )
-        else:
-            delete_endpoint = self.core_api.delete_namespaced_endpoints(
-                name=safe_name,
-                namespace=self.namespace,
-                body=client.V1DeleteOptions(grace_period_seconds=0),
-            )
-            await self._delete_if_exists('endpoint', safe_name, delete_endpoint)
-
-        if service is not None:
-            await ensure_object(
-                self.core_api.create_namespaced_service,
-                self.core_api.patch_namespaced_service,
-                body=service,
-                kind='service',
-            )
-            await exponential_backoff(
-                lambda: full_name in self.service_reflector.services,
-                'Could not find services/%s after creating it' % safe_name,
-            )
-        else:
-            delete_service = self.core_api.delete_namespaced_service(
-                name=safe_name,
-                namespace=self.namespace,
-                body=client.V1DeleteOptions(grace_period_seconds=0),
+        async def ensure_endpoint():
+            if endpoint is not None:
+                await self._ensure_object(
+                    self.core_api.patch_namespaced_endpoints,
+                    body=endpoint,
+                    kind='endpoints',
+                    safe_name=safe_name,
+                )
+                await self.endpoint_reflector.wait_for_key(full_name)
+            else:
+                await self._delete_leftover(
+                    self.endpoint_reflector,
+                    'endpoint',
+                    self.core_api.delete_namespaced_endpoints,
+                    safe_name,
+                )
+
+        async def ensure_service():
+            if service is not None:
+                await self._ensure_object(
+                    self.core_api.patch_namespaced_service,
+                    body=service,
+                    kind='service',
+                    safe_name=safe_name,
+                )
+                await self.service_reflector.wait_for_key(full_name)
+            else:
+                await self._delete_leftover(
+                    self.service_reflector,
+                    'service',
+                    self.core_api.delete_namespaced_service,
+                    safe_name,
+                )
+
+        async def ensure_ingress():
+            await self._ensure_object(
+                self.networking_api.patch_namespaced_ingress,
+                body=ingress,
+                kind='ingress',
+                safe_name=safe_name,
             )
-            await self._delete_if_exists('service', safe_name, delete_service)
-
-        await ensure_object(
-            self.networking_api.create_namespaced_ingress,
-            self.networking_api.patch_namespaced_ingress,
-            body=ingress,
-            kind='ingress',
-        )
+            await self.ingress_reflector.wait_for_key(full_name)
 
-        await exponential_backoff(
-            lambda: full_name in self.ingress_reflector.ingresses,
-            'Could not find ingress/%s after creating it' % safe_name,
-        )
+        # If we fail to create a new route, we clean up what was created of it,
+        # but an existing route we fail to update is left in place.
+        if not self.ingress_reflector.first_load_future.done():
+            await self.ingress_reflector.first_load_future
+        is_new_route = full_name not in self.ingress_reflector.ingresses
+
+        # The endpoint, service, and ingress don't depend on each other
+        # existing to be created, so we create them and wait for them to be
+        # observed by our reflectors in parallel. If one of them fails, the
+        # others are cancelled instead of left running.
+        tasks = [
+            asyncio.ensure_future(ensure_endpoint()),
+            asyncio.ensure_future(ensure_service()),
+            asyncio.ensure_future(ensure_ingress()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if is_new_route:
+                try:
+                    await self.delete_route(routespec)
+                except Exception:
+                    self.log.exception(
+                        'Could not clean up after failing to add route %s', routespec
+                    )
+            raise
 
     async def delete_route(self, routespec):
         # We just ensure that these objects are deleted.
         # This means if some of them are already deleted, we just let it
         # be.
 
-        safe_name = self._safe_name_for_routespec(routespec).lower()
+        safe_name = self._object_name_for_routespec(routespec)
 
         delete_options = client.V1DeleteOptions(grace_period_seconds=0)
 
-        delete_endpoint = self.core_api.delete_namespaced_endpoints(
+        delete_endpoint = partial(
+            self.core_api.delete_namespaced_endpoints,
             name=safe_name,
             namespace=self.namespace,
             body=delete_options,
         )
 
-        delete_service = self.core_api.delete_namespaced_service(
+        delete_service = partial(
+            self.core_api.delete_namespaced_service,
             name=safe_name,
             namespace=self.namespace,
             body=delete_options,
         )
 
-        delete_ingress = self.networking_api.delete_namespaced_ingress(
+        delete_ingress = partial(
+            self.networking_api.delete_namespaced_ingress,
             name=safe_name,
             namespace=self.namespace,
             body=delete_options,
@@ -565,7 +828,9 @@ class KubeIngressProxy(Proxy):
         )
 
         # This seems like cleanest way to parallelize all three of these while
-        # also making sure we only ignore the exception when it's a 404.
+        # also making sure we only ignore the exception when it's a 404. None
+        # of the requests is made before they are gathered, so all three are
+        # in flight at the same time.
         # The order matters for endpoint & service - deleting the service deletes
         # the endpoint in the background. This can be racy however, so we do so
         # explicitly ourselves as well. In the future, we can probably try a
@@ -581,19 +846,8 @@ class KubeIngressProxy(Proxy):
         if not self.ingress_reflector.first_load_future.done():
             await self.ingress_reflector.first_load_future
 
-        routes = {
-            ingress["metadata"]["annotations"]['hub.jupyter.org/proxy-routespec']: {
-                'routespec': ingress["metadata"]["annotations"][
-                    'hub.jupyter.org/proxy-routespec'
-                ],
-                'target': ingress["metadata"]["annotations"][
-                    'hub.jupyter.org/proxy-target'
-                ],
-                'data': json.loads(
-                    ingress["metadata"]["annotations"]['hub.jupyter.org/proxy-data']
-                ),
-            }
-            for ingress in self.ingress_reflector.ingresses.values()
-        }
-
-        return routes
+        # The reflector's routes are only updated by its watch task running on
+        # this event loop, so reading them needs no snapshot of the ingresses.
+        # The index is still copied, but only so that the routes returned
+        # aren't changed by watch events while JupyterHub is using them.
+        return dict(self.ingress_reflector.routes_by_routespec)
@@ -175,6 +175,9 @@ class ResourceReflector(LoggingConfigurable):
 
         self.first_load_future = asyncio.Future()
 
+        # futures of pending wait_for_key calls, by the key they wait for
+        self._key_waiters = {}
+
         # Make sure that we know kind, whether we should omit the
         #  namespace, and what our list_method_name is.  For the things
         #  we already know about, we can derive list_method_name from
@@ -253,9 +256,53 @@ class ResourceReflector(LoggingConfigurable):
         if not self.first_load_future.done():
             # signal that we've loaded our initial data at least once
             self.first_load_future.set_result(None)
+        for key in [key for key in self._key_waiters if key in self.resources]:
+            self._notify_key_waiters(key)
         # return the resource version so we can hook up a watch
         return initial_resources["metadata"]["resourceVersion"]
 
+    def on_event(self, event_type, ref_key, resource):
+        """
+        Called for every watch event, after `resources` has been updated.
+
+        Does nothing by default, subclasses can override it to keep state
+        derived from `resources` up-to-date without recomputing it from
+        scratch.
+        """
+
+    def _notify_key_waiters(self, key):
+        for future in self._key_waiters.pop(key, []):
+            if not future.done():
+                future.set_result(None)
+
+    async def wait_for_key(self, key, timeout=10):
+        """
+        Wait for a resource with the given key to be present in `resources`.
+
+        Waiting is done without polling, we are woken up only when a resource
+        with this key is added or updated.
+
+        Raises asyncio.TimeoutError if the resource isn't present after
+        `timeout` seconds.
+        """
+        if key in self.resources:
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._key_waiters.setdefault(key, []).append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(
+                f"Could not find {self.kind} {key} after {timeout}s"
+            )
+        finally:
+            waiters = self._key_waiters.get(key, [])
+            if future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self._key_waiters[key]
+
     async def _watch_and_update(self):
         """
         Keeps the current list of resources up-to-date
@@ -350,6 +397,9 @@ class ResourceReflector(LoggingConfigurable):
                             # This is an atomic operation on the dictionary!
                             self.resources[ref_key] = resource
                             resource_version = resource["metadata"]["resourceVersion"]
+                        self.on_event(watch_event['type'], ref_key, resource)
+                        if watch_event['type'] != 'DELETED':
+                            self._notify_key_waiters(ref_key)
                         if self._stopping:
                             self.log.info("%s watcher stopped: inner", self.kind)
                             break
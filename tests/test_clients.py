@@ -14,6 +14,8 @@ async def test_shared_client():
     ext2 = shared_client("NetworkingV1Api")
     assert ext is ext2
     assert ext is not core
+    # all API groups share one ApiClient, and with it one connection pool
+    assert ext.api_client is core.api_client
 
 
 def test_shared_client_close():
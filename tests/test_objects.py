@@ -2010,6 +2010,7 @@ def test_make_ingress_for_ip(reuse_existing_services, target, ip):
     )
 
     assert endpoint == {
+        'apiVersion': 'v1',
         'kind': 'Endpoints',
         'metadata': {
             'annotations': {
@@ -2027,6 +2028,7 @@ def test_make_ingress_for_ip(reuse_existing_services, target, ip):
     }
 
     assert service == {
+        'apiVersion': 'v1',
         'kind': 'Service',
         'metadata': {
             'annotations': {
@@ -2047,6 +2049,7 @@ def test_make_ingress_for_ip(reuse_existing_services, target, ip):
         },
     }
     assert ingress == {
+        'apiVersion': 'networking.k8s.io/v1',
         'kind': 'Ingress',
         'metadata': {
             'annotations': {
@@ -2122,6 +2125,7 @@ def test_make_ingress_for_service_reuse_existing_services_enabled(target):
     assert service is None
 
     assert ingress == {
+        'apiVersion': 'networking.k8s.io/v1',
         'kind': 'Ingress',
         'metadata': {
             'annotations': {
@@ -2208,6 +2212,7 @@ def test_make_ingress_for_service_reuse_existing_services_disabled(
     assert endpoint is None
 
     assert service == {
+        'apiVersion': 'v1',
         'kind': 'Service',
         'metadata': {
             'annotations': {
@@ -2230,6 +2235,7 @@ def test_make_ingress_for_service_reuse_existing_services_disabled(
     }
 
     assert ingress == {
+        'apiVersion': 'networking.k8s.io/v1',
         'kind': 'Ingress',
         'metadata': {
             'annotations': {
@@ -2319,6 +2325,7 @@ def test_make_ingress_for_service_reuse_existing_services_ignored(
     assert endpoint is None
 
     assert service == {
+        'apiVersion': 'v1',
         'kind': 'Service',
         'metadata': {
             'annotations': {
@@ -2341,6 +2348,7 @@ def test_make_ingress_for_service_reuse_existing_services_ignored(
     }
 
     assert ingress == {
+        'apiVersion': 'networking.k8s.io/v1',
         'kind': 'Ingress',
         'metadata': {
             'annotations': {
@@ -2407,6 +2415,7 @@ def test_make_ingress_with_subdomain_host(target):
     )
 
     assert ingress == {
+        'apiVersion': 'networking.k8s.io/v1',
         'kind': 'Ingress',
         'metadata': {
             'annotations': {
@@ -2484,6 +2493,7 @@ def test_make_ingress_with_specifications(target, ip):
     )
 
     assert endpoint == {
+        'apiVersion': 'v1',
         'kind': 'Endpoints',
         'metadata': {
             'annotations': {
@@ -2501,6 +2511,7 @@ def test_make_ingress_with_specifications(target, ip):
     }
 
     assert service == {
+        'apiVersion': 'v1',
         'kind': 'Service',
         'metadata': {
             'annotations': {
@@ -2521,6 +2532,7 @@ def test_make_ingress_with_specifications(target, ip):
         },
     }
     assert ingress == {
+        'apiVersion': 'networking.k8s.io/v1',
         'kind': 'Ingress',
         'metadata': {
             'annotations': {
@@ -2616,6 +2628,7 @@ def test_make_ingress_external_name_with_specifications():
     assert endpoint is None
 
     assert service == {
+        'apiVersion': 'v1',
         'kind': 'Service',
         'metadata': {
             'annotations': {
@@ -2637,6 +2650,7 @@ def test_make_ingress_external_name_with_specifications():
         },
     }
     assert ingress == {
+        'apiVersion': 'networking.k8s.io/v1',
         'kind': 'Ingress',
         'metadata': {
             'annotations': {
@@ -2747,6 +2761,7 @@ def test_make_ingress_with_specifications_and_matching_subdomain_host(target, ho
     )
 
     assert ingress == {
+        'apiVersion': 'networking.k8s.io/v1',
         'kind': 'Ingress',
         'metadata': {
             'annotations': {
@@ -2842,6 +2857,7 @@ def test_make_ingress_with_specifications_and_not_matching_subdomain_host(target
     )
 
     assert ingress == {
+        'apiVersion': 'networking.k8s.io/v1',
         'kind': 'Ingress',
         'metadata': {
             'annotations': {
@@ -0,0 +1,234 @@
+import asyncio
+from functools import partial
+
+import pytest
+import pytest_asyncio
+from jupyterhub.utils import exponential_backoff
+from kubernetes_asyncio.client.rest import ApiException
+
+from kubespawner.clients import load_config
+from kubespawner.proxy import IngressReflector, KubeIngressProxy
+
+
+@pytest_asyncio.fixture
+async def proxy(kube_ns, kube_client):
+    proxy = KubeIngressProxy(namespace=kube_ns)
+    yield proxy
+    await asyncio.gather(
+        proxy.ingress_reflector.stop(),
+        proxy.service_reflector.stop(),
+        proxy.endpoint_reflector.stop(),
+    )
+
+
+@pytest.fixture
+def unstarted_proxy():
+    # a proxy that has not been initialized, so no k8s clients or reflectors
+    # are created, for testing methods that don't talk to the api-server
+    return KubeIngressProxy.__new__(KubeIngressProxy)
+
+
+@pytest.mark.parametrize(
+    "routespec, expected",
+    [
+        ("/", "jupyter--2F-route"),
+        ("/user/Alex/", "jupyter--2Fuser-2F-41lex-2F-route"),
+    ],
+)
+def test_safe_name_for_routespec(unstarted_proxy, routespec, expected):
+    safe_name = unstarted_proxy._safe_name_for_routespec(routespec)
+    assert safe_name == expected
+    # escapism escapes with uppercase hex, so the names of the k8s objects
+    # created for a route must be lowercased explicitly
+    assert safe_name != safe_name.lower()
+
+
+@pytest.mark.parametrize(
+    "routespec, expected",
+    [
+        ("/", "jupyter--2f-route"),
+        ("/user/Alex/", "jupyter--2fuser-2f-41lex-2f-route"),
+        (
+            "/user/" + "a" * 60 + "/",
+            "jupyter--2fuser-2faaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-8e9d6e",
+        ),
+        (
+            "/user/" + "A" * 60 + "/",
+            "jupyter--2fuser-2f-41-41-41-41-41-41-41-41-41-41-41-41-4-901955",
+        ),
+    ],
+)
+def test_object_name_for_routespec(unstarted_proxy, routespec, expected):
+    object_name = unstarted_proxy._object_name_for_routespec(routespec)
+    assert object_name == expected
+    assert object_name == object_name.lower()
+    assert len(object_name) <= 63
+
+
+def _ingress(name, namespace, annotations):
+    return {
+        "metadata": {
+            "name": name,
+            "namespace": namespace,
+            "resourceVersion": "1",
+            "annotations": annotations,
+        }
+    }
+
+
+async def test_ingress_reflector_skips_invalid_routes(kube_ns):
+    load_config()
+    reflector = IngressReflector(namespace=kube_ns)
+    valid = {
+        "hub.jupyter.org/proxy-routespec": "/user/valid/",
+        "hub.jupyter.org/proxy-target": "http://127.0.0.1:8888",
+        "hub.jupyter.org/proxy-data": '{"user": "valid"}',
+    }
+    invalid_data = dict(valid, **{"hub.jupyter.org/proxy-data": "{not json"})
+
+    reflector.on_event("ADDED", f"{kube_ns}/valid", _ingress("valid", kube_ns, valid))
+    reflector.on_event("ADDED", f"{kube_ns}/missing", _ingress("missing", kube_ns, {}))
+    reflector.on_event(
+        "ADDED", f"{kube_ns}/invalid", _ingress("invalid", kube_ns, invalid_data)
+    )
+    assert list(reflector.routes_by_routespec) == ["/user/valid/"]
+    assert reflector.routes_by_routespec["/user/valid/"]["data"] == {"user": "valid"}
+
+    # a route that becomes invalid is dropped
+    reflector.on_event(
+        "MODIFIED", f"{kube_ns}/valid", _ingress("valid", kube_ns, invalid_data)
+    )
+    assert reflector.routes == {}
+    assert reflector.routes_by_routespec == {}
+
+
+async def test_ingress_reflector_duplicate_routespec(kube_ns):
+    load_config()
+    reflector = IngressReflector(namespace=kube_ns)
+    annotations = {
+        "hub.jupyter.org/proxy-routespec": "/user/dup/",
+        "hub.jupyter.org/proxy-target": "http://127.0.0.1:8888",
+        "hub.jupyter.org/proxy-data": "{}",
+    }
+
+    reflector.on_event("ADDED", f"{kube_ns}/a", _ingress("a", kube_ns, annotations))
+    reflector.on_event("ADDED", f"{kube_ns}/b", _ingress("b", kube_ns, annotations))
+    assert (
+        reflector.routes_by_routespec["/user/dup/"] is reflector.routes[f"{kube_ns}/b"]
+    )
+
+    # deleting the indexed ingress falls back to the remaining one
+    reflector.on_event("DELETED", f"{kube_ns}/b", _ingress("b", kube_ns, annotations))
+    assert (
+        reflector.routes_by_routespec["/user/dup/"] is reflector.routes[f"{kube_ns}/a"]
+    )
+
+    reflector.on_event("DELETED", f"{kube_ns}/a", _ingress("a", kube_ns, annotations))
+    assert reflector.routes_by_routespec == {}
+
+
+async def test_ingress_reflector_modified_route(kube_ns):
+    load_config()
+    reflector = IngressReflector(namespace=kube_ns)
+    annotations = {
+        "hub.jupyter.org/proxy-routespec": "/user/mod/",
+        "hub.jupyter.org/proxy-target": "http://127.0.0.1:8888",
+        "hub.jupyter.org/proxy-data": "{}",
+    }
+    ref_key = f"{kube_ns}/mod"
+
+    reflector.on_event("ADDED", ref_key, _ingress("mod", kube_ns, annotations))
+
+    # a modified route with the same routespec replaces the indexed route
+    modified = dict(annotations, **{"hub.jupyter.org/proxy-data": '{"a": 1}'})
+    reflector.on_event("MODIFIED", ref_key, _ingress("mod", kube_ns, modified))
+    assert reflector.routes_by_routespec == {"/user/mod/": reflector.routes[ref_key]}
+    assert reflector.routes_by_routespec["/user/mod/"]["data"] == {"a": 1}
+
+    # a modified route with another routespec moves in the index
+    moved = dict(annotations, **{"hub.jupyter.org/proxy-routespec": "/user/moved/"})
+    reflector.on_event("MODIFIED", ref_key, _ingress("mod", kube_ns, moved))
+    assert reflector.routes_by_routespec == {"/user/moved/": reflector.routes[ref_key]}
+
+
+async def test_add_update_delete_route(proxy):
+    routespec = "/user/round-trip/"
+    target = "http://10.0.0.1:8888"
+
+    async def get_route():
+        routes = await proxy.get_all_routes()
+        return routes.get(routespec)
+
+    async def route_has_data(data):
+        route = await get_route()
+        return route is not None and route["data"] == data
+
+    await proxy.add_route(routespec, target, {"user": "round-trip"})
+    route = await get_route()
+    assert route["target"] == target
+    assert route["data"] == {"user": "round-trip"}
+
+    # adding the route again applies the changes to the existing objects
+    await proxy.add_route(routespec, target, {"user": "round-trip", "updated": True})
+    await exponential_backoff(
+        partial(route_has_data, {"user": "round-trip", "updated": True}),
+        "Route was not updated",
+        timeout=30,
+    )
+    assert (await get_route())["target"] == target
+
+    await proxy.delete_route(routespec)
+
+    async def route_is_deleted():
+        return await get_route() is None
+
+    await exponential_backoff(route_is_deleted, "Route was not deleted", timeout=30)
+
+
+async def test_add_route_failure_cleans_up(proxy, monkeypatch):
+    routespec = "/user/add-route-failure/"
+    name = proxy._object_name_for_routespec(routespec)
+    applied = asyncio.Event()
+    waiting = set()
+    cancelled = set()
+
+    def wait_forever(kind):
+        async def wait_for_key(key, timeout=10):
+            # the endpoints or service has been applied when this is called
+            waiting.add(kind)
+            if len(waiting) == 2:
+                applied.set()
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.add(kind)
+                raise
+
+        return wait_for_key
+
+    async def fail_patch_ingress(*args, **kwargs):
+        await applied.wait()
+        raise ApiException(status=422)
+
+    monkeypatch.setattr(
+        proxy.endpoint_reflector, "wait_for_key", wait_forever("endpoints")
+    )
+    monkeypatch.setattr(
+        proxy.service_reflector, "wait_for_key", wait_forever("service")
+    )
+    monkeypatch.setattr(
+        proxy.networking_api, "patch_namespaced_ingress", fail_patch_ingress
+    )
+
+    with pytest.raises(ApiException) as exc_info:
+        await proxy.add_route(routespec, "http://10.0.0.1:8888", {})
+    assert exc_info.value.status == 422
+    assert cancelled == {"endpoints", "service"}
+
+    # the endpoints and service created for the new route were deleted
+    with pytest.raises(ApiException) as exc_info:
+        await proxy.core_api.read_namespaced_endpoints(name, proxy.namespace)
+    assert exc_info.value.status == 404
+    with pytest.raises(ApiException) as exc_info:
+        await proxy.core_api.read_namespaced_service(name, proxy.namespace)
+    assert exc_info.value.status == 404
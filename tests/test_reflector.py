@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+
+from kubespawner import reflector
+from kubespawner.clients import load_config
+from kubespawner.reflector import NamespacedResourceReflector
+
+
+def _service(name, resource_version="1"):
+    return {
+        "metadata": {
+            "name": name,
+            "namespace": "ns",
+            "resourceVersion": resource_version,
+        }
+    }
+
+
+class MockListResponse:
+    """Trivial stand-in for the raw response of a list request."""
+
+    ok = True
+
+    def __init__(self, items):
+        self.items = items
+
+    async def read(self):
+        return json.dumps(
+            {"items": self.items, "metadata": {"resourceVersion": "2"}}
+        ).encode()
+
+
+class MockWatch:
+    """Stand-in for kubernetes_asyncio's Watch, streaming the given events."""
+
+    events = ()
+
+    def stream(self, method, **kwargs):
+        events = self.events
+
+        class Stream:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc_info):
+                pass
+
+            async def __aiter__(self):
+                for event in events:
+                    yield event
+
+        return Stream()
+
+    def stop(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+@pytest_asyncio.fixture
+async def services_reflector():
+    load_config()
+    return NamespacedResourceReflector(kind="services", namespace="ns")
+
+
+async def test_wait_for_key_timeout(services_reflector):
+    with pytest.raises(asyncio.TimeoutError, match="ns/missing"):
+        await services_reflector.wait_for_key("ns/missing", timeout=0.01)
+    assert services_reflector._key_waiters == {}
+
+
+async def test_wait_for_key_woken_by_list(services_reflector, monkeypatch):
+    async def list_services(**kwargs):
+        return MockListResponse([_service("a")])
+
+    monkeypatch.setattr(
+        services_reflector.api, "list_namespaced_service", list_services
+    )
+
+    waiter = asyncio.ensure_future(services_reflector.wait_for_key("ns/a"))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    await services_reflector._list_and_update()
+    await asyncio.wait_for(waiter, 1)
+    assert services_reflector._key_waiters == {}
+
+
+async def test_wait_for_key_woken_by_watch_events(services_reflector, monkeypatch):
+    async def list_and_update(resource_version=None):
+        return "1"
+
+    def stop_after_events():
+        yield {"type": "DELETED", "raw_object": _service("deleted")}
+        # the reflector stops after handling the next event
+        services_reflector._stopping = True
+        yield {"type": "ADDED", "raw_object": _service("added")}
+
+    monkeypatch.setattr(services_reflector, "_list_and_update", list_and_update)
+    monkeypatch.setattr(MockWatch, "events", stop_after_events())
+    monkeypatch.setattr(reflector.watch, "Watch", MockWatch)
+
+    deleted_waiter = asyncio.ensure_future(
+        services_reflector.wait_for_key("ns/deleted")
+    )
+    added_waiter = asyncio.ensure_future(services_reflector.wait_for_key("ns/added"))
+    await asyncio.sleep(0)
+
+    await services_reflector._watch_and_update()
+    await asyncio.wait_for(added_waiter, 1)
+    # a DELETED event doesn't wake those waiting for the deleted resource
+    await asyncio.sleep(0)
+    assert not deleted_waiter.done()
+    assert list(services_reflector._key_waiters) == ["ns/deleted"]
+
+    deleted_waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await deleted_waiter
+    assert services_reflector._key_waiters == {}